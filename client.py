@@ -2,6 +2,11 @@
 # server, sending commands, and receiving responses.
 
 import socket  # provides networking capabilities for the client.
+import struct  # packs the header of binary command frames.
+
+# Binary frame opcodes, matching CommandReader.OPCODES in server.py.
+OP_SET, OP_GET, OP_REMOVE, OP_PRINT = 1, 2, 3, 4
+FRAME_HEADER = struct.Struct("<BHH")  # opcode, key length, value length
 
 
 class Client:
@@ -14,6 +19,9 @@ class Client:
         """Establish a connection to the server."""
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Creates a TCP socket using IPv4.
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Commands are small request/response messages, so send them immediately instead of letting
+            # Nagle's algorithm batch them.
             self.sock.connect((self.host, self.port))
             print(f"Connected to server at {self.host}:{self.port}", flush=True)
             # Attempts to connect to the server; if successful,
@@ -25,26 +33,64 @@ class Client:
 
     def send(self, message):
         """
-        Encodes the message as bytes and sends it over the
-        socket using sendall(), ensuring the entire message is sent.
+        Encodes the message as a newline-terminated line of bytes and sends it over
+        the socket using sendall(), ensuring the entire message is sent.
         """
 
         if self.sock:
             try:
-                self.sock.sendall(message.encode())
+                self.sock.sendall(message.encode() + b"\n")
             except Exception as e:
                 print(f"Error sending message: {e}", flush=True)
 
+    def send_many(self, pairs):
+        """
+        Sets every (key, value) pair in one MSET command, so the whole batch costs
+        a single round trip and a single disk commit on the server, and returns the reply.
+        """
+
+        self.send("MSET " + " ".join(f"{key} {value}" for key, value in pairs))
+        return self.receive()
+
+    def send_frame(self, opcode, key="", value=""):
+        """
+        Sends a command as a binary frame ('<u8 opcode><u16 key length><u16 value length><key><value>'),
+        which the server dispatches without tokenizing, and returns the reply.
+        """
+
+        if self.sock:
+            key, value = key.encode(), value.encode()
+            try:
+                self.sock.sendall(FRAME_HEADER.pack(opcode, len(key), len(value)) + key + value)
+            except Exception as e:
+                print(f"Error sending message: {e}", flush=True)
+                return None
+            return self.receive()
+
+    def put(self, key, data):
+        """
+        Uploads a bytes value with 'PUT <key> <length>' followed by the raw payload,
+        so the value may contain whitespace or binary data, and returns the server's reply.
+        """
+
+        if self.sock:
+            try:
+                self.sock.sendall(f"PUT {key} {len(data)}\n".encode() + data)
+            except Exception as e:
+                print(f"Error sending message: {e}", flush=True)
+                return None
+            return self.receive()
+
     def receive(self):
         """
-        Waits for up to 1024 bytes from the server. If data is received,
+        Waits for up to 65536 bytes from the server. If data is received,
         decodes and returns it; otherwise, returns None if the connection
         is closed or an error occurs
         """
 
         if self.sock:
             try:
-                data = self.sock.recv(1024)
+                data = self.sock.recv(65536)
                 if not data:
                     return None
                 return data.decode()
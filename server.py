@@ -1,13 +1,41 @@
+import asyncio
 import socket
 import threading
 import os
+import collections
+import heapq
+import mmap
+import struct
+import tempfile
+import logging
+import logging.handlers
+import queue
+import zlib
+import errno
+
+try:
+    import fcntl
+except ImportError:  # Windows; the store lock file is skipped there.
+    fcntl = None
 
 """
+asyncio: Runs the event loop that serves every client connection from a single thread.
 socket: Provides low‐level networking functionality to create TCP connections.
-threading: Allows creation and management of threads so that multiple clients can be handled concurrently.
-os: Provides operating system interfaces (here, used to check file existence).
+threading: Provides the locks and the background flusher thread that protect and persist the store.
+os: Provides operating system interfaces (here, used to check file existence and swap in snapshots atomically).
+collections: Provides the deque used to queue log records waiting to be flushed.
+heapq: Streams a k-way merge over sorted segment files.
+mmap, struct: Map the snapshot and segment files into memory and decode their length-prefixed records in place.
+tempfile: Creates the scratch files PUT payloads are received into before being moved into place.
+zlib: Provides crc32, a hash that stays the same across restarts, for picking a key's shard.
+errno: Recognizes the EINVAL a filesystem returns when it does not support O_DIRECT writes.
+fcntl: Takes an exclusive lock on the store so a second server can't open the same files.
+logging, queue: Report server activity; a QueueHandler hands records to a background thread so
+client handlers never block on writing to the console.
 """
 
+logger = logging.getLogger(__name__)
+
 
 class NetworkException(Exception):
     pass
@@ -32,92 +60,660 @@ program to differentiate and handle various network‐related errors
 """
 
 
+class FileResponse:  # A response whose body lives in a file and is streamed to the client with sendfile().
+    def __init__(self, file, size):
+        self.file = file  # An open binary file object; the receiver is responsible for closing it.
+        self.size = size
+
+
+class LogFile:  # The append-only write-ahead log, written with O_DIRECT where the platform and filesystem allow it.
+    BLOCK = 4096  # O_DIRECT writes must cover whole blocks, from a block-aligned buffer.
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = None  # The page-aligned staging buffer for direct writes; anonymous mmaps are page-aligned.
+        self.closed = False
+        self.direct = hasattr(os, "O_DIRECT")
+        """
+        O_DIRECT skips the page cache, so a commit is copied once, from our buffer to the disk, rather
+        than into the cache and then out again; O_DSYNC makes each write durable on its own, so no
+        separate fsync is needed. Platforms without O_DIRECT (macOS, Windows) and filesystems that
+        refuse it use an ordinary buffered write followed by fsync instead.
+        """
+        if self.direct:
+            try:
+                self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_DIRECT | os.O_DSYNC, 0o644)
+                size = os.fstat(self.fd).st_size
+                if size % self.BLOCK:
+                    os.ftruncate(self.fd, size + self.BLOCK - size % self.BLOCK)
+                    # A log left by a buffered write ends mid-block; NUL-pad it so the next append is aligned.
+            except OSError:
+                self.direct = False
+        if not self.direct:
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o644)
+
+    def append(self, data):
+        """Durably append data to the log: a single write, followed by an fsync unless the write was direct."""
+        if not self.direct:
+            os.write(self.fd, data)
+            os.fsync(self.fd)
+            return
+
+        size = len(data) + -len(data) % self.BLOCK  # Rounded up to whole blocks; replay skips the NUL padding.
+        if self.buffer is None or len(self.buffer) < size:
+            if self.buffer is not None:
+                self.buffer.close()
+            self.buffer = mmap.mmap(-1, size)
+        self.buffer[:len(data)] = data
+        self.buffer[len(data):size] = bytes(size - len(data))
+        try:
+            with memoryview(self.buffer) as view:
+                os.write(self.fd, view[:size])
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            # The filesystem accepted O_DIRECT at open but rejects the writes; nothing was written.
+            os.close(self.fd)
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            self.direct = False
+            self.append(data)
+
+    def truncate(self):
+        """Empty the log. Offset 0 is block-aligned, so direct appends can carry on from there."""
+        os.ftruncate(self.fd, 0)
+
+    def close(self):
+        os.close(self.fd)
+        if self.buffer is not None:
+            self.buffer.close()
+        self.closed = True
+
+
 class KeyValueStore:  # Manages an in-memory dictionary for key–value pairs and persists them to a file.
-    def __init__(self, filepath="store.txt"):
-        self.filepath = filepath  # The file where data will be saved.
+    COMPACT_THRESHOLD = 1000  # Number of log records written before the memtable is flushed to a segment.
+    MAX_SEGMENTS = 8  # Segment count above which the background merger runs.
+    FLUSH_INTERVAL = 0.005  # How long the flusher waits for more records before committing a batch.
+    FLUSH_BATCH = 256  # Queue depth at which the flusher commits without waiting out the interval.
+
+    RECORD_HEADER = struct.Struct("<II")  # Snapshot/segment record header: key length, value length.
+    TOMBSTONE = 0xFFFFFFFF  # Value length marking a deleted key in a segment; no value bytes follow.
+    MGET_BLOB_ERROR = b"ERROR: Key '%s' holds a PUT value; fetch it with GET\n"  # Blobs may contain tabs and newlines.
+
+    def __init__(self, filepath="store.db"):
+        self.filepath = filepath  # The snapshot file holding the compacted store.
+        self.log_path = filepath + ".log"  # The append-only log of mutations made since the last segment.
+        self.print_cache = PrintCache(filepath + ".print")  # The rendered PRINT output.
+        self.blob_dir = filepath + ".blobs"  # Values uploaded with PUT, one file per key.
         self.store = {}  # store: A dictionary holding the key–value pairs.
+        self.blobs = {}  # blobs: Keys whose value lives in blob_dir, mapped to the value's size in bytes.
+        self.memtable = {}  # Changes since the last segment: key -> new value, or None for a deletion.
+        self.segment_seq = 0  # Sequence number of the newest segment.
+        self.merger = None  # The background thread merging segments, while one is running.
         self.lock = threading.RLock()
         """
         A reentrant lock (RLock) ensures that if a method (like set()) calls another
         method (like save()) that also needs a lock, the same thread can re-acquire it without deadlocking.
+        Only mutations take the lock; get() reads the dictionary directly.
         """
 
+        self.version = 0  # Bumped on every mutation so the rendered PRINT output knows when it is stale.
+
+        self.log_records = 0  # Records appended since the last segment was written.
         self.load()  # Called to populate the store with any pre-existing data.
+        self.log = LogFile(self.log_path)
+
+        self.pending = collections.deque()  # (records, count, done_event) entries waiting for the next commit.
+        self.flush_cv = threading.Condition(self.lock)
+        self.running = True
+        self.flusher = threading.Thread(target=self._flusher, daemon=True)
+        self.flusher.start()
+        """
+        A single background thread owns the log file. Mutations from every client thread are
+        queued in self.pending and committed together with one durable write, so many
+        concurrent writers share the cost of each disk flush (group commit).
+        """
 
     def load(self):
         """
-        Load key-value pairs from the file into the store.
-        Each line in the file should be formatted as 'key<TAB>value'.
+        Load key-value pairs from the snapshot file into the store, apply the segment files on top
+        of it oldest first, then replay the log. The snapshot and segments are sequences of
+        '<u32 key length><u32 value length><key><value>' records and are memory-mapped, so records
+        are decoded straight out of the page cache. Each log line is either 'S<TAB>key<TAB>value'
+        or 'D<TAB>key'; runs of NUL bytes between log records are padding from direct writes.
         """
-        if not os.path.exists(self.filepath):  # Checks if the persistence file exists.
-            return  # Ensures thread-safe file reading and dictionary updates.
         with self.lock:
             try:
-                with open(self.filepath, "r") as file:
-                    for line in file:
-                        line = line.strip()
-                        if line:
-                            # Split only on the first tab character
-                            parts = line.split("\t", 1)
-                            if len(parts) == 2:
-                                key, value = parts
-                                self.store[key] = value
-                                """
-                                Each non-empty line is stripped and split on the first tab character.
-                                If two parts result, they are stored as key and value.
-                                """
+                legacy_path = os.path.splitext(self.filepath)[0] + ".txt"
+                if not os.path.exists(self.filepath) and os.path.exists(legacy_path):
+                    self._import_legacy(legacy_path)  # Upgrading from the text store.txt format.
+
+                # Checks if the persistence file exists.
+                if os.path.exists(self.filepath):
+                    self.store.update(self._read_records(self.filepath))
+
+                for seq, path in self._segments():
+                    for key, value in self._read_records(path):
+                        if value is None:
+                            self.store.pop(key, None)
+                        else:
+                            self.store[key] = value
+                    self.segment_seq = seq
+
+                os.makedirs(self.blob_dir, exist_ok=True)
+                for name in os.listdir(self.blob_dir):
+                    path = os.path.join(self.blob_dir, name)
+                    if name.startswith("."):
+                        os.remove(path)  # A PUT that never finished; its key was never added.
+                    else:
+                        self.blobs[bytes.fromhex(name)] = os.path.getsize(path)
+
+                if os.path.exists(self.log_path):
+                    intact = 0  # Length of the log up to the end of its last complete record.
+                    with open(self.log_path, "rb") as file:
+                        for line in file:
+                            if not line.endswith(b"\n"):
+                                break  # A torn final record from a crash mid-write; everything before it is intact.
+                            intact += len(line)
+                            parts = line[:-1].lstrip(b"\0").split(b"\t", 2)
+                            if parts[0] == b"S" and len(parts) == 3:
+                                self.store[parts[1]] = self.memtable[parts[1]] = parts[2]
+                            elif parts[0] == b"D" and len(parts) == 2:
+                                self.store.pop(parts[1], None)
+                                self.memtable[parts[1]] = None
+                            self.log_records += 1
+                            # Replayed changes go back into the memtable: they are in no segment yet.
+                    if intact < os.path.getsize(self.log_path):
+                        os.truncate(self.log_path, intact)
+                        # Drops the torn tail (or trailing padding) so new records don't run on from it.
+
+            except Exception as e:
+                logger.error("Error loading data: %s", e)
+
+    def _import_legacy(self, path):
+        """
+        One-time upgrade from the original text file of 'key<TAB>value' lines: parse it the way the
+        old load() did, write its pairs out as the snapshot, then rename the text file out of the way.
+        """
+        items = {}
+        with open(path, "rb") as file:
+            for line in file:
+                # Split only on the first tab character
+                parts = line.strip().split(b"\t", 1)
+                if len(parts) == 2:
+                    items[parts[0]] = parts[1]
+        self._write_records(self.filepath, items.items())
+        os.replace(path, path + ".migrated")  # Kept as a backup; it is never read again.
+        logger.info("Imported %d keys from %s", len(items), path)
+
+    def _read_records(self, path):
+        """Yield the (key, value) records of a snapshot or segment file; value is None for a deletion."""
+        if os.path.getsize(path) == 0:
+            return  # An empty file can't be mapped and holds nothing anyway.
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header = self.RECORD_HEADER
+            offset, end = 0, len(mm)
+            while offset + header.size <= end:
+                klen, vlen = header.unpack_from(mm, offset)
+                offset += header.size
+                key = mm[offset:offset + klen]
+                offset += klen
+                if vlen == self.TOMBSTONE:
+                    yield key, None
+                else:
+                    yield key, mm[offset:offset + vlen]
+                    offset += vlen
+
+    def _write_records(self, path, items):
+        """Atomically replace path with the given (key, value) records, writing None values as tombstones."""
+        tmp_path = path + ".tmp"
+        pack = self.RECORD_HEADER.pack
+        with open(tmp_path, "wb") as file:
+            for key, value in items:
+                if value is None:
+                    file.write(pack(len(key), self.TOMBSTONE))
+                    file.write(key)
+                else:
+                    file.write(pack(len(key), len(value)))
+                    file.write(key)
+                    file.write(value)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)  # Atomically swaps in the new file.
+
+    def segment_path(self, seq):
+        """Return the file segment number seq is kept in."""
+        return f"{self.filepath}.{seq:08d}.seg"
+
+    def _segments(self):
+        """Return (seq, path) for every segment file on disk, oldest first."""
+        directory = os.path.dirname(self.filepath) or "."
+        prefix = os.path.basename(self.filepath) + "."
+        segments = []
+        for name in os.listdir(directory):
+            seq = name[len(prefix):-len(".seg")]
+            if name.startswith(prefix) and name.endswith(".seg") and seq.isdigit():
+                segments.append((int(seq), os.path.join(directory, name)))
+        return sorted(segments)
+
+    def save(self, record, count=1):
+        """
+        Queue mutation records (count of them, joined into one bytes object) for the flusher and
+        return an event that is set once they have been durably written to the log. Must be called
+        with self.lock held so that records reach the log in the same order their changes were
+        applied to the store.
+        """
+        done = threading.Event()
+        self.pending.append((record, count, done))
+        self.flush_cv.notify()
+        return done
+
+    def _flusher(self):
+        """Commit queued records in batches: one durable log append per batch."""
+        while True:
+            with self.flush_cv:
+                self.flush_cv.wait_for(lambda: self.pending or not self.running)
+                if not self.pending:
+                    return  # Shutting down with nothing left to commit.
+                # Give other writers a short window to join this batch.
+                self.flush_cv.wait_for(lambda: len(self.pending) >= self.FLUSH_BATCH or not self.running,
+                                       timeout=self.FLUSH_INTERVAL)
+                batch = list(self.pending)
+                self.pending.clear()
+
+            try:
+                self.log.append(b"".join(record for record, _, _ in batch))
+                self.log_records += sum(count for _, count, _ in batch)  # Log lines, as load() counts them.
+                if self.log_records >= self.COMPACT_THRESHOLD:
+                    self.flush_memtable()
 
             except Exception as e:
-                print(f"Error loading data: {e}")
+                logger.error("Error saving data: %s", e)
+            finally:
+                for _, _, done in batch:
+                    done.set()  # Wakes every set()/remove() call waiting on this batch.
 
-    def save(self):
+    def flush_memtable(self):
+        """
+        Write the keys changed since the last segment to a new immutable segment file, sorted by
+        key, and truncate the log it replaces. Only the changed keys are written, so the cost is
+        independent of the size of the store. Only the flusher thread (or close(), once the
+        flusher has stopped) writes to the log, so this runs without holding the lock. Records
+        still queued when the memtable is swapped out are already reflected in the segment;
+        replaying them afterwards is harmless.
+        """
+        with self.lock:
+            memtable, self.memtable = self.memtable, {}
+            if memtable:
+                self.segment_seq += 1
+            seq = self.segment_seq
+        if memtable:
+            self._write_records(self.segment_path(seq), sorted(memtable.items()))
+        self.log.truncate()
+        self.log_records = 0
+
+        if len(self._segments()) > self.MAX_SEGMENTS and self.running and \
+                (self.merger is None or not self.merger.is_alive()):
+            self.merger = threading.Thread(target=self._merge, daemon=True)
+            self.merger.start()
+
+    def _merge(self):
+        """
+        Background merge. While the segments together are small next to the snapshot they are
+        merged into a single segment; once they have grown to half its size everything is
+        folded into a new snapshot. Each byte is rewritten a bounded number of times before
+        reaching the snapshot, instead of the whole store being rewritten on every flush.
+        """
         try:
-            with open(self.filepath, "w") as file:
-                for key, value in self.store.items():
-                    file.write(f"{key}\t{value}\n")
-                    """
-                    The file is opened (or created) for writing;
-                    each key–value pair is written on a separate line, separated by a tab.
-                    """
+            segments = self._segments()
+            segment_bytes = sum(os.path.getsize(path) for _, path in segments)
+            snapshot_bytes = os.path.getsize(self.filepath) if os.path.exists(self.filepath) else 0
+            if segment_bytes * 2 >= snapshot_bytes:
+                self.compact()
+            else:
+                self._merge_segments(segments)
 
         except Exception as e:
-            print(f"[ERROR] Error saving data: {e}", flush=True)
-            """
-            If any error occurs, it’s printed immediately.
-            """
+            logger.error("Error merging segments: %s", e)
+
+    def _merge_segments(self, segments):
+        """
+        Merge sorted segments into one with a streaming k-way merge, keeping the newest record
+        for each key. Tombstones are kept because the snapshot may still hold the deleted keys.
+        The result replaces the newest input and the older inputs are deleted oldest first, so
+        a crash part-way leaves a set of segments that still replays to the same store.
+        """
+        def tagged(seq, path):
+            for key, value in self._read_records(path):
+                yield key, -seq, value  # For equal keys the newest segment sorts first.
+
+        def newest(records):
+            last = None
+            for key, _, value in records:
+                if key != last:
+                    last = key
+                    yield key, value
+
+        merged = heapq.merge(*(tagged(seq, path) for seq, path in segments))
+        self._write_records(segments[-1][1], newest(merged))
+        for _, path in segments[:-1]:
+            os.remove(path)
+
+    def compact(self):
+        """
+        Write the whole store to a fresh snapshot and delete the segments it covers, oldest first.
+        The snapshot is taken from memory, so it may already include changes that are also still
+        in newer segments or the log; replaying those on top of it is harmless.
+        """
+        with self.lock:
+            items = list(self.store.items())
+            covered = self.segment_seq
+        self._write_records(self.filepath, items)
+        for seq, path in self._segments():
+            if seq <= covered:
+                os.remove(path)
+
+    def close(self):
+        """Stop the flusher, fold the segments and log into the snapshot and release the log file."""
+        with self.flush_cv:
+            self.running = False
+            self.flush_cv.notify()
+        self.flusher.join()  # The flusher commits anything still queued before exiting.
+        if self.merger is not None:
+            self.merger.join()
+        if not self.log.closed:
+            self.compact()
+            self.log.truncate()
+            self.log.close()
 
     def set(self, key, value):
-        with self.lock:  # Ensures that updating the store and saving to disk are atomic operations.
-            self.store[key] = value
-            self.save()
-        return f"Added key '{key}' with value '{value}'\n"  # Confirms that the key has been added.
+        with self.lock:  # Ensures that updating the store and logging the change are atomic operations.
+            self._drop_blob(key)
+            self.store[key] = self.memtable[key] = value
+            self.version += 1
+            done = self.save(b"S\t%s\t%s\n" % (key, value))
+        done.wait()  # Waits outside the lock so other writers can join the same commit.
+        return b"Added key '%s' with value '%s'\n" % (key, value)  # Confirms that the key has been added.
+
+    def mset(self, pairs):
+        """
+        Set several key-value pairs under a single lock acquisition. All of their log records
+        are queued as one entry, so the whole batch costs one wait for one commit.
+        """
+        self.mset_nowait(pairs).wait()
+        return b"Added %d keys\n" % len(pairs)
+
+    def mset_nowait(self, pairs):
+        """Apply and queue an MSET like mset(), but return its commit event instead of waiting on it."""
+        with self.lock:
+            records = []
+            for key, value in pairs:
+                self._drop_blob(key)
+                self.store[key] = self.memtable[key] = value
+                records.append(b"S\t%s\t%s\n" % (key, value))
+            self.version += 1
+            return self.save(b"".join(records), len(records))
+
+    def mget(self, keys):
+        """
+        Return the values for several keys as one tab-separated line; missing keys give empty fields.
+        A key holding a PUT value can't be put on the line, so it gives an error naming the key instead.
+        """
+        store, blobs = self.store, self.blobs
+        values = []
+        for key in keys:
+            value = store.get(key)
+            if value is None:
+                if key in blobs:
+                    return self.MGET_BLOB_ERROR % key
+                value = b""
+            values.append(value)
+        return b"\t".join(values) + b"\n"
 
     def get(self, key):  # Retrieve the value for the specified key.
-        with self.lock:  # Uses the lock for safe reading from the dictionary.
-            if key in self.store:
-                return self.store[key]
-            else:
-                return f"Key '{key}' not found."  # Either the associated value or an error message returned.
+        # A single dict lookup is atomic under the GIL, so reads don't need to queue behind writers.
+        # The stored value already is the reply, so there is no encoded-response cache in front of this:
+        # it would cost a second lookup per read and an invalidation per write to return the same object.
+        value = self.store.get(key)
+        if value is not None:
+            return value  # Values are kept as bytes, so they go to the client exactly as stored.
+
+        size = self.blobs.get(key)
+        if size is not None:
+            try:
+                return FileResponse(open(self.blob_path(key), "rb"), size)
+            except FileNotFoundError:
+                pass  # Removed or overwritten since the lookup above.
+        return b"Key '%s' not found." % key  # Either the associated value or an error message returned.
 
     def remove(self, key):
         """Remove a key-value pair from the store."""
         with self.lock:
-            if key in self.store:
+            if self._drop_blob(key):
+                self.version += 1
+                return b"Removed key '%s'.\n" % key
+            if key not in self.store:
+                return b"Key '%s' not found." % key
+            del self.store[key]
+            self.memtable[key] = None
+            self.version += 1
+            done = self.save(b"D\t%s\n" % key)
+        done.wait()
+        return b"Removed key '%s'.\n" % key
+
+    def blob_path(self, key):
+        """Return the file a blob value for key is kept in; the name is the hex-encoded key."""
+        return os.path.join(self.blob_dir, key.hex())
+
+    def new_blob_file(self):
+        """Create a scratch file for an incoming PUT payload and return its (fd, path)."""
+        return tempfile.mkstemp(prefix=".put-", dir=self.blob_dir)
+
+    def put_blob(self, key, tmp_path, size):
+        """
+        Move a fully received PUT payload into place as the value of key. The payload was written
+        to tmp_path outside the lock, so only the rename and the bookkeeping happen under it.
+        """
+        done = None
+        with self.lock:
+            os.replace(tmp_path, self.blob_path(key))
+            self.blobs[key] = size
+            if key in self.store:  # A PUT replaces any SET value for the same key.
                 del self.store[key]
-                self.save()
-                return f"Removed key '{key}'.\n"
-            else:
-                return f"Key '{key}' not found."
+                self.memtable[key] = None
+                done = self.save(b"D\t%s\n" % key)
+            self.version += 1
+        if done:
+            done.wait()
+        return b"Stored %d bytes for key '%s'\n" % (size, key)
+
+    def _drop_blob(self, key):
+        """Delete the blob value for key, if it has one. Must be called with self.lock held."""
+        if self.blobs.pop(key, None) is None:
+            return False
+        os.remove(self.blob_path(key))
+        return True
+
+    def snapshot(self):
+        """Return copies of the (key, value) pairs and the (key, blob size) pairs."""
+        with self.lock:  # Only held long enough to copy the store; formatting happens without blocking writers.
+            return list(self.store.items()), list(self.blobs.items())
 
     def print_store(self):
-        """Return a formatted string of all key-value pairs."""
+        """Return all key-value pairs as formatted bytes."""
+        return render_store(*self.snapshot())
+
+    def print_file(self):
+        """Return the PRINT output, as bytes or as a FileResponse; see PrintCache."""
+        return self.print_cache.response(self.version, self.print_store)
+
+
+class PrintCache:
+    """
+    The PRINT output of a store, kept in a file and cached against the store's version. After a
+    change the output is rendered and returned as bytes, since writing it to a file first would
+    only add a copy. If the store is PRINTed again unchanged, that output is written to the file,
+    and from then on it is returned as a FileResponse and sent with sendfile() straight from the
+    page cache. Each caller gets its own file object, so concurrent sends don't share a position.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.version = None  # The store version the file was rendered from.
+        self.rendered = None  # (version, output) of the last PRINT, until it is written to the file.
+        self.lock = threading.Lock()  # Serializes re-rendering the PRINT file.
+
+    def response(self, version, render):
+        """
+        Return the PRINT output for a store at version, calling render() for it when it isn't cached.
+        version must be read before render() runs, so the output is never older than its version.
+        """
         with self.lock:
-            if not self.store:
-                return "Store is empty.\n"
-            response = ""
-            for key, value in self.store.items():
-                response += f"[KEY]: {key}\t[VALUE]: {value}\n"
-            return response
+            if self.version != version:
+                if self.rendered is None or self.rendered[0] != version:
+                    self.rendered = (version, render())
+                    return self.rendered[1]
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "wb") as file:
+                    file.write(self.rendered[1])
+                os.replace(tmp_path, self.path)  # Clients still sending the old file keep reading it.
+                self.version, self.rendered = version, None
+            file = open(self.path, "rb")
+        return FileResponse(file, os.fstat(file.fileno()).st_size)
+
+
+def render_store(items, blobs):
+    """Format (key, value) and (key, blob size) pairs for PRINT, built in a single growing buffer."""
+    if not items and not blobs:
+        return b"Store is empty.\n"
+    buf = bytearray()
+    extend = buf.extend
+    for key, value in items:
+        extend(b"[KEY]: ")
+        extend(key)
+        extend(b"\t[VALUE]: ")
+        extend(value)
+        extend(b"\n")
+    for key, size in blobs:
+        extend(b"[KEY]: %s\t[BLOB]: %d bytes\n" % (key, size))
+    return bytes(buf)
+
+
+class ShardedKeyValueStore:  # Spreads keys over several independent KeyValueStores.
+    SHARDS = 16  # Must be a power of two.
+
+    def __init__(self, filepath="store.db"):
+        self.filepath = filepath
+        self.lock_file = None
+        if fcntl is not None:
+            self.lock_file = open(filepath + ".lock", "wb")
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.lock_file.close()
+                raise RuntimeError(f"Another server is already using {filepath}")
+            # Taken before any file is read, so a second server in the same directory fails here instead of
+            # replaying (and truncating) logs the first one is still writing.
+        root, ext = os.path.splitext(filepath)
+        self.shards = [KeyValueStore(f"{root}.{n}{ext}") for n in range(self.SHARDS)]
+        """
+        Each shard has its own lock, log, flusher and segment files, so writers to different
+        shards never wait on each other. Keys are assigned with crc32 rather than hash(), which
+        is randomized per process and would move keys between shards across restarts.
+        """
+        self.print_cache = PrintCache(filepath + ".print")
+        self._migrate(filepath)
+
+    def _migrate(self, filepath):
+        """
+        Upgrade from an unsharded store: if its files are at filepath (or there is a legacy text
+        file, which KeyValueStore imports), load it, re-insert every key into its shard, move its blob
+        files across and then retire the old files. They are only retired once every shard has
+        committed its share, so a migration cut short by a crash simply runs again on the next start.
+        """
+        legacy_path = os.path.splitext(filepath)[0] + ".txt"
+        if not any(os.path.exists(path) for path in (filepath, filepath + ".log", legacy_path)):
+            return
+        old = KeyValueStore(filepath)
+        by_shard = collections.defaultdict(list)
+        for key, value in old.store.items():
+            by_shard[self.shard(key)].append((key, value))
+        for shard, pairs in by_shard.items():
+            shard.mset(pairs)
+        for key, size in old.blobs.items():
+            self.shard(key).put_blob(key, old.blob_path(key), size)
+        old.close()  # Folds everything into the snapshot at filepath and empties its log.
+
+        os.replace(filepath, filepath + ".migrated")  # Kept as a backup; it is never read again.
+        os.remove(old.log_path)
+        os.rmdir(old.blob_dir)  # Empty now: every blob was moved and load() removed unfinished uploads.
+        if os.path.exists(old.print_cache.path):
+            os.remove(old.print_cache.path)
+        logger.info("Migrated %d keys and %d blobs from %s into %d shards",
+                    len(old.store), len(old.blobs), filepath, self.SHARDS)
+
+    def shard(self, key):
+        return self.shards[zlib.crc32(key) & (self.SHARDS - 1)]
+
+    @property
+    def version(self):
+        # Every shard's version only ever grows, so the sum changes whenever any shard does.
+        return sum(shard.version for shard in self.shards)
+
+    def set(self, key, value):
+        return self.shard(key).set(key, value)
+
+    def get(self, key):
+        return self.shard(key).get(key)
+
+    def remove(self, key):
+        return self.shard(key).remove(key)
+
+    def mset(self, pairs):
+        """Set pairs on their shards, then wait for every shard's commit at once rather than one after another."""
+        by_shard = collections.defaultdict(list)
+        for key, value in pairs:
+            by_shard[self.shard(key)].append((key, value))
+        for done in [shard.mset_nowait(group) for shard, group in by_shard.items()]:
+            done.wait()
+        return b"Added %d keys\n" % len(pairs)
+
+    def mget(self, keys):
+        """Return the values for several keys as one tab-separated line, like KeyValueStore.mget()."""
+        values = []
+        for key in keys:
+            shard = self.shard(key)
+            value = shard.store.get(key)
+            if value is None:
+                if key in shard.blobs:
+                    return KeyValueStore.MGET_BLOB_ERROR % key
+                value = b""
+            values.append(value)
+        return b"\t".join(values) + b"\n"
+
+    def new_blob_file(self, key):
+        """Create a scratch file for key's incoming PUT payload in its shard's blob directory."""
+        return self.shard(key).new_blob_file()
+
+    def put_blob(self, key, tmp_path, size):
+        return self.shard(key).put_blob(key, tmp_path, size)
+
+    def print_store(self):
+        """Return all key-value pairs as formatted bytes, snapshotting each shard under its own lock."""
+        items, blobs = [], []
+        for shard in self.shards:
+            shard_items, shard_blobs = shard.snapshot()
+            items += shard_items
+            blobs += shard_blobs
+        return render_store(items, blobs)
+
+    def print_file(self):
+        return self.print_cache.response(self.version, self.print_store)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        if self.lock_file is not None:
+            self.lock_file.close()  # Releases the lock on the store.
+            self.lock_file = None
 
 
 # This class parses incoming text commands and maps them to the corresponding
@@ -126,53 +722,170 @@ class KeyValueStore:  # Manages an in-memory dictionary for key–value pairs an
 class CommandParser:
     def __init__(self, kv_store):
         self.kv_store = kv_store
+        # Maps each command to the method that checks its arguments and runs it, so dispatch
+        # is a single dict lookup instead of a string comparison per command.
+        self.dispatch = {
+            b"SET": self._set,
+            b"GET": self._get,
+            b"REMOVE": self._remove,
+            b"MSET": self._mset,
+            b"MGET": self._mget,
+            b"PRINT": self._print,
+        }
 
     def parse_and_execute(self, command):
-        # Remove extra whitespace
-        command = command.strip()
-        if not command:
-            return "ERROR: Empty command\n"
+        # Commands arrive as bytes and are tokenized without decoding; keys and values stay bytes throughout.
+        # split() with no arguments also drops surrounding whitespace.
         tokens = command.split()
         if not tokens:
-            return "ERROR: Invalid command\n"
+            return b"ERROR: Empty command\n"
 
         # Convert command to uppercase to allow case-insensitive commands.
-        cmd = tokens[0].upper()
-
-        # Checks the correct number of arguments for
-        # each command and then calls the corresponding KeyValueStore method.
-        if cmd == "SET":
-            if len(tokens) != 3:
-                return "ERROR: SET command requires 2 arguments: key and value\n"
-            key, value = tokens[1], tokens[2]
-            return self.kv_store.set(key, value)
-        elif cmd == "GET":
-            if len(tokens) != 2:
-                return "ERROR: GET command requires 1 argument: key\n"
-            key = tokens[1]
-            return self.kv_store.get(key)
-        elif cmd == "REMOVE":
-            if len(tokens) != 2:
-                return "ERROR: REMOVE command requires 1 argument: key\n"
-            key = tokens[1]
-            return self.kv_store.remove(key)
-        elif cmd == "PRINT":
-            return self.kv_store.print_store()
-        else:
-            return f"ERROR: Unknown command '{tokens[0]}'\n"
+        handler = self.dispatch.get(tokens[0].upper())
+        if handler is None:
+            return b"ERROR: Unknown command '%s'\n" % tokens[0]
+        return handler(tokens)
+
+    # Each handler checks the correct number of arguments for its
+    # command and then calls the corresponding KeyValueStore method.
+    def _set(self, tokens):
+        if len(tokens) != 3:
+            return b"ERROR: SET command requires 2 arguments: key and value\n"
+        return self.kv_store.set(tokens[1], tokens[2])
+
+    def _get(self, tokens):
+        if len(tokens) != 2:
+            return b"ERROR: GET command requires 1 argument: key\n"
+        return self.kv_store.get(tokens[1])
+
+    def _remove(self, tokens):
+        if len(tokens) != 2:
+            return b"ERROR: REMOVE command requires 1 argument: key\n"
+        return self.kv_store.remove(tokens[1])
+
+    def _mset(self, tokens):
+        if len(tokens) < 3 or len(tokens) % 2 == 0:
+            return b"ERROR: MSET command requires key-value pairs: key value [key value ...]\n"
+        return self.kv_store.mset(list(zip(tokens[1::2], tokens[2::2])))
+
+    def _mget(self, tokens):
+        if len(tokens) < 2:
+            return b"ERROR: MGET command requires at least 1 argument: key [key ...]\n"
+        return self.kv_store.mget(tokens[1:])
+
+    def _print(self, tokens):
+        return self.kv_store.print_file()
+
+
+class CommandReader:
+    """
+    Splits the bytes arriving on one connection into commands. A single socket read usually
+    carries several pipelined commands, and has_command() tells the caller whether the next one
+    is already buffered, so replies can be held back and written to the socket together.
+
+    Text commands are newline-terminated lines. Binary frames are
+    '<u8 opcode><u16 key length><u16 value length><key><value>'; opcodes are control bytes that
+    can never start a text command, so both protocols can share a connection.
+    """
+    FRAME_HEADER = struct.Struct("<BHH")
+    OPCODES = {1: "SET", 2: "GET", 3: "REMOVE", 4: "PRINT"}
+
+    def __init__(self, reader, limit):
+        self.reader = reader
+        self.limit = limit  # Read size, and the longest text line accepted.
+        self.buf = bytearray()  # Received bytes not yet handed out as commands.
+        self.skipping = False  # Discarding the rest of an over-long line.
+
+    def _frame_end(self):
+        """Return the end offset of the binary frame at the start of buf, or None if its header is incomplete."""
+        if len(self.buf) < self.FRAME_HEADER.size:
+            return None
+        _, klen, vlen = self.FRAME_HEADER.unpack_from(self.buf)
+        return self.FRAME_HEADER.size + klen + vlen
+
+    def has_command(self):
+        """Return whether a complete command (or an over-long line to report) is already buffered."""
+        buf = self.buf
+        if not buf:
+            return False
+        if buf[0] in self.OPCODES:
+            end = self._frame_end()
+            return end is not None and len(buf) >= end
+        return b"\n" in buf or len(buf) > self.limit
+
+    async def next_command(self):
+        """
+        Return the next command: the bytes of a text line, an (opcode, key, value) tuple for a
+        binary frame, or None once the client has closed the connection. Raises MessageException
+        for a text line longer than the limit, after discarding it.
+        """
+        while True:
+            buf = self.buf
+            if buf and buf[0] in self.OPCODES:
+                end = self._frame_end()
+                if end is not None and len(buf) >= end:
+                    header = self.FRAME_HEADER.size
+                    opcode, klen, _ = self.FRAME_HEADER.unpack_from(buf)
+                    frame = (opcode, bytes(buf[header:header + klen]), bytes(buf[header + klen:end]))
+                    del buf[:end]
+                    return frame
+            elif buf:
+                end = buf.find(b"\n")
+                if end >= 0:
+                    line = bytes(buf[:end + 1])
+                    del buf[:end + 1]
+                    if end > self.limit:
+                        raise MessageException("Command too long")
+                    return line
+                if len(buf) > self.limit:
+                    buf.clear()
+                    self.skipping = True
+                    raise MessageException("Command too long")
+
+            data = await self.reader.read(self.limit)
+            if not data:
+                return None
+            if self.skipping:
+                end = data.find(b"\n")
+                if end < 0:
+                    continue
+                data = data[end + 1:]
+                self.skipping = False
+            buf += data
+
+    async def read_payload(self, size):
+        """Yield the next size bytes in chunks, starting with whatever is already buffered."""
+        chunk = bytes(self.buf[:size])
+        del self.buf[:size]
+        remaining = size - len(chunk)
+        if chunk:
+            yield chunk
+        while remaining:
+            chunk = await self.reader.read(min(remaining, self.limit))
+            if not chunk:
+                raise ConnectionException("Connection closed in the middle of a PUT payload")
+            remaining -= len(chunk)
+            yield chunk
 
 
 # The Server class is responsible for setting up the TCP socket, accepting
-# incoming connections, and creating a new thread for each client.
+# incoming connections, and serving every client from a single asyncio event loop.
 # Encapsulates the server’s networking functionality.
 class Server:
+    READ_BUFFER_SIZE = 65536  # Longest command line accepted; one socket read fills the buffer with many commands.
+
     def __init__(self, host="0.0.0.0", port=3490):
         self.host = host  # Where the server listens.
         self.port = port
         self.server_socket = None  # The socket used to accept incoming connections.
-        self.kv_store = KeyValueStore()  # Shared store and command parser used by all clients.
+        self.kv_store = ShardedKeyValueStore()  # Shared store and command parser used by all clients.
         self.parser = CommandParser(self.kv_store)
         self.is_running = False  # A flag to control the server loop.
+        self.loop = None  # The event loop serving clients, and the future that ends it, once serve() is running.
+        self.stopping = None
+        self.state_lock = threading.Lock()  # Orders stop() against serve() starting up.
+        self.loop_done = threading.Event()  # Clear while start() is running its event loop.
+        self.loop_done.set()
 
     def setup_server(self):  # Uses IPv4 and TCP.
         """Initialize the server socket, bind it to the host and port, and begin listening."""
@@ -187,62 +900,210 @@ class Server:
             self.server_socket.listen(10)
             # Binds the socket and begins listening for up to 10 queued connections.
 
-            print(f"Server listening on {self.host}:{self.port}")
+            self.port = self.server_socket.getsockname()[1]  # The port actually bound, if 0 asked for any free one.
+            logger.info("Server listening on %s:%s", self.host, self.port)
         except Exception as e:
             raise ConnectionException(f"Failed to setup server: {e}")
 
-    def handle_client(self, client_socket, client_address):
-        print(f"Connection from {client_address}")  # Prints the client’s address upon connection and disconnection.
-        with client_socket:
+    async def handle_put(self, commands, header):
+        """
+        Handle 'PUT <key> <length>\\n<payload>'. The payload is copied into a scratch blob file as
+        it arrives; the writes, the fsync and the move into place run on the executor.
+        """
+        tokens = header.split()
+        if len(tokens) != 3 or not tokens[2].isdigit():
+            return b"ERROR: PUT command requires 2 arguments: key and length\n"
+        key, size = tokens[1], int(tokens[2])
+        if size == 0:  # No payload follows, so nothing needs to be read past the header.
+            return b"ERROR: PUT length must be at least 1 byte\n"  # An empty GET reply would leave the client waiting.
+
+        loop = asyncio.get_running_loop()
+        fd, tmp_path = self.kv_store.new_blob_file(key)
+        try:
+            async for chunk in commands.read_payload(size):
+                await loop.run_in_executor(None, os.write, fd, chunk)  # Disk writes would stall every client.
+            await loop.run_in_executor(None, os.fsync, fd)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        finally:
+            os.close(fd)
+
+        if len(key) > 127:  # Checked after reading so the payload doesn't get parsed as commands.
+            os.remove(tmp_path)
+            return b"ERROR: PUT key must be at most 127 bytes\n"  # Blob files are named by the hex-encoded key.
+        return await loop.run_in_executor(None, self.kv_store.put_blob, key, tmp_path, size)
+
+    async def handle_client(self, reader, writer):
+        client_address = writer.get_extra_info("peername")
+        logger.info("Connection from %s", client_address)  # Logs the client’s address upon connection and disconnection.
+        # asyncio already sets TCP_NODELAY on accepted connections, so small replies aren't held back by Nagle.
+        loop = asyncio.get_running_loop()
+        commands = CommandReader(reader, self.READ_BUFFER_SIZE)
+        replies = []  # Replies held back while more pipelined commands are already buffered.
+        try:
             while True:
+                if not commands.has_command():
+                    # About to wait for input: flush what we have.
+                    await self.send_replies(writer, replies, client_address)
                 try:
-                    data = client_socket.recv(1024)  # Reads up to 1024 bytes from the client.
-                    if not data:
-                        print(f"Client {client_address} disconnected.")
-                        break
-                    message = data.decode().strip()
-                    print(f"Received from {client_address}: {message}")
-                    if message.lower() == "quit":
-                        print(f"Client {client_address} requested to quit.")
-                        break  # Decodes the received bytes, strips extra whitespace, and checks for a “quit” command.
-
-                    response = self.parser.parse_and_execute(message)
-                    client_socket.sendall(response.encode())
-                    # Passes the message to CommandParser and sends the resulting response back to the client.
-
-                    print(f"Response sent to {client_address}: {response.strip()}")
-                except Exception as e:
-                    print(f"Error handling client {client_address}: {e}")
+                    command = await commands.next_command()
+                except MessageException as e:
+                    replies.append(b"ERROR: %s\n" % str(e).encode())
+                    continue
+                if command is None:
+                    logger.info("Client %s disconnected.", client_address)
                     break
-                    # Catches any exceptions during client handling and closes the connection gracefully.
 
-        print(f"Connection with {client_address} closed.")
+                if isinstance(command, tuple):
+                    response = await self.handle_frame(*command)
+                else:
+                    message = command.strip()
+                    logger.debug("Received from %s: %r", client_address, message)
+                    if message.lower() == b"quit":
+                        logger.info("Client %s requested to quit.", client_address)
+                        break  # Strips extra whitespace from the received bytes and checks for a “quit” command.
+
+                    prefix = message[:4].upper()
+                    if prefix == b"PUT ":
+                        # Don't hold earlier replies behind a large upload.
+                        await self.send_replies(writer, replies, client_address)
+                        response = await self.handle_put(commands, message)
+                    elif prefix in (b"GET ", b"MGET"):
+                        response = self.parser.parse_and_execute(message)  # Lock-free lookups; cheap enough for the loop.
+                    else:
+                        # SET/REMOVE wait for their group commit and PRINT may re-render its file, so they
+                        # run on the executor to keep the event loop free for other clients.
+                        response = await loop.run_in_executor(None, self.parser.parse_and_execute, message)
+                    # Passes the message to CommandParser and queues the resulting response for the client.
+
+                if isinstance(response, FileResponse):
+                    await self.send_replies(writer, replies, client_address)
+                    await self.send_file(writer, response, client_address)
+                else:
+                    replies.append(response)
+            await self.send_replies(writer, replies, client_address)
+        except asyncio.CancelledError:
+            pass  # The server is shutting down; close the connection quietly.
+        except Exception as e:
+            logger.error("Error handling client %s: %s", client_address, e)
+            # Catches any exceptions during client handling and closes the connection gracefully.
+        finally:
+            writer.close()
+
+        logger.info("Connection with %s closed.", client_address)
+
+    async def handle_frame(self, opcode, key, value):
+        """Execute one binary frame by calling the KeyValueStore directly, skipping the text parser."""
+        if b"\t" in key or b"\n" in key or b"\t" in value or b"\n" in value:
+            return b"ERROR: Keys and values may not contain tabs or newlines\n"  # Both delimit the log and PRINT.
+
+        loop = asyncio.get_running_loop()
+        if opcode == 1:
+            if not key:
+                return b"ERROR: SET frame requires a key\n"
+            if not value:
+                return b"ERROR: SET frame requires a value\n"  # An empty GET reply would leave the client waiting.
+            return await loop.run_in_executor(None, self.kv_store.set, key, value)
+        elif opcode == 2:
+            return self.kv_store.get(key)
+        elif opcode == 3:
+            return await loop.run_in_executor(None, self.kv_store.remove, key)
+        else:
+            return await loop.run_in_executor(None, self.kv_store.print_file)
+
+    async def send_replies(self, writer, replies, client_address):
+        """
+        Write every queued reply with a single writelines() call and clear the queue, so the
+        replies to a batch of pipelined commands leave in one send (sendmsg() where asyncio
+        supports it) instead of one syscall per command.
+        """
+        if not replies:
+            return
+        writer.writelines(replies)
+        logger.debug("Response sent to %s: %d replies", client_address, len(replies))
+        replies.clear()
+        await writer.drain()
+
+    async def send_file(self, writer, response, client_address):
+        """Stream a FileResponse to the client with sendfile()."""
+        with response.file:
+            await asyncio.get_running_loop().sendfile(writer.transport, response.file, 0, response.size)
+        logger.debug("Response sent to %s: <%d bytes>", client_address, response.size)
+
+    async def serve(self):
+        """Accept clients on the listening socket, serving each one as a task on this event loop."""
+        clients = set()  # The handler task of every open connection.
+
+        async def handle(reader, writer):
+            task = asyncio.current_task()
+            clients.add(task)
+            try:
+                await self.handle_client(reader, writer)
+            finally:
+                clients.discard(task)
+
+        server = await asyncio.start_server(handle, sock=self.server_socket)
+        loop = asyncio.get_running_loop()
+        stopping = loop.create_future()  # Cancelled by stop(), or with this task by Ctrl+C.
+        with self.state_lock:
+            if not self.is_running:  # stop() ran before the loop got going.
+                server.close()
+                return
+            self.loop, self.stopping = loop, stopping
+        async with server:
+            try:
+                await stopping
+            finally:
+                # Leaving the block waits for every connection to close (Python 3.12.1+), so end them first.
+                # serve_forever() is not used because, once cancelled, it waits for them itself.
+                for task in clients:
+                    task.cancel()
 
     def start(self):
-        """Start the server: set up the socket and continuously accept new client connections."""
+        """Start the server: set up the socket and run the event loop that accepts and serves clients."""
         self.setup_server()
+        self.loop_done.clear()
         self.is_running = True
         try:
-            while self.is_running:  # After setting up, continuously accepts new client connections.
-                client_socket, client_address = self.server_socket.accept()
-                # Create a new thread for each client connection.
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_address))
-                client_thread.daemon = True  # allows threads to close when main thread exits
-                client_thread.start()
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
-            print("Server is shutting down gracefully.")
+            logger.info("Server is shutting down gracefully.")
             # Uses a try/except block to catch KeyboardInterrupt (Ctrl+C) and then calls stop().
+        except asyncio.CancelledError:
+            pass  # stop() was called from another thread.
         finally:
+            self.loop_done.set()
             self.stop()
 
     def stop(self):
-        # Closes the server socket and updates the running flag to stop accepting new connections.
-        self.is_running = False
+        # Ends the event loop, waiting for it when called from another thread, and only then closes the
+        # store and the socket, so no client handler can reach a closed store.
+        with self.state_lock:
+            if not self.is_running:
+                return  # Already stopped, e.g. by another thread before start() unwound.
+            self.is_running = False
+            loop, stopping = self.loop, self.stopping
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(stopping.cancel)
+            except RuntimeError:
+                pass  # The loop has already finished.
+        self.loop_done.wait()  # A loop that hadn't registered yet sees is_running is False and returns.
+        self.kv_store.close()
         if self.server_socket:
             self.server_socket.close()
-            print("Server socket closed.")
-
+            logger.info("Server socket closed.")
 
 if __name__ == "__main__":
-    server = Server()
-    server.start()
+    # Log records are queued by whichever thread emits them and written out by the listener's thread.
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(level=logging.INFO, format="%(message)s",
+                        handlers=[logging.handlers.QueueHandler(log_queue)])
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    try:
+        server = Server()
+        server.start()
+    finally:
+        listener.stop()